@@ -9,8 +9,8 @@ Annotation Format (MAF) files into a pandas dataframe.
 
 For VCF files:
     Ignores the ##commented lines but retrives the keys from the VEP Consequence (CSQ) field
-    Uses the CSQ keys to create a dictionary with the keys:value from VEP
-    Filters the variants of interest.
+    Uses the CSQ keys to split the annotations from VEP into columns
+    Filters the variants of interest. Only records with a CSQ annotation of the specified variant and variant class are kept
     Extends the VCF file with the columns of VEP when a list of transcript IDs is provided.
     If no list is provided then the extension is not done
 
@@ -23,17 +23,111 @@ Usage example:
     >>> import VCF_functions
     >>> df_vcf = read_process_vcf(file, variant='missense_variant', variant_class='SNP', id_list = ['ENSTXXXXX', 'ENSTYYYY'], return_case_id=False)
     >>> df_maf = read_process_maf(file, variant='Missense_Mutation', consequence='missense_variant', variant_class='SNP', id_list = ['ENSTXXXXX', 'ENSTYYYY'])
+    >>> dfs_vcf = read_process_vcf_many([file_a, file_b], variant='missense_variant', variant_class='SNP', id_list = ['ENSTXXXXX', 'ENSTYYYY'])
 """
 
 import pandas as pd
 import numpy as np
 import gzip
+import re
+import io
+import shutil
+import subprocess
+import contextlib
+import os
+import errno
+import hashlib
+import functools
+from concurrent.futures import ProcessPoolExecutor
 
-def rows2skip(file):
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.csv as pacsv
+except ImportError:
+    pa = None
+
+# Number of rows read at a time with pandas, from MAF files and from VCF files when pyarrow is not installed
+CHUNKSIZE = 100_000
+
+# Number of bytes read at a time from VCF files by pyarrow
+BLOCK_SIZE = 1 << 26
+
+# External programs used to decompress gzip files, in order of preference. `zcat` is not used 
+# because on macOS it only reads .Z files
+DECOMPRESSORS = [['pigz', '-dc'], ['gzip', '-dc']]
+
+# Part of the key of cached files. Increase it when a change to the processing changes the output 
+# so that files cached by older versions are not used
+CACHE_VERSION = 1
+
+# Keys for the values in the `all_effects` column of MAF files
+# from https://docs.gdc.cancer.gov/Data/File_Formats/MAF_Format/#:~:text=46%20%2D%20all_effects,Sift%2CPolyPhen%2CStrand%5D)
+# added 'all_effects' to the end of each key to avoid column names already present in the MAF files
+MAF_KEYS = ['Symbol_all_effects','Consequence_all_effects','HGVSp_Short_all_effects','Transcript_ID_all_effects',\
+            'RefSeq_all_effects','HGVSc_all_effects','Impact_all_effects','Canonical_all_effects',\
+            'Sift_all_effects','PolyPhen_all_effects','Strand_all_effects'] 
+
+# Types of the fixed columns of VCF files, the sample columns are inferred
+VCF_DTYPES = {'#CHROM': 'str', 'POS': 'int32', 'ID': 'str', 'REF': 'str', 'ALT': 'str', 'QUAL': 'str', 'FILTER': 'str', 'INFO': 'str'}
+
+# Columns with few distinct values stored with the categorical dtype
+VCF_CATEGORY_COLUMNS = ['CHROM', 'FILTER', 'Consequence', 'VARIANT_CLASS', 'IMPACT', 'CANONICAL', 'STRAND']
+MAF_CATEGORY_COLUMNS = ['Variant_Classification', 'Variant_Type', 'Consequence_all_effects', 'Impact_all_effects', 
+                        'Canonical_all_effects', 'Strand_all_effects']
+
+# Matches the value of the 'CSQ' field inside the INFO column
+CSQ_PATTERN = re.compile(r'(?:^|;)CSQ=(?P<CSQ>[^;]*)')
+
+@contextlib.contextmanager
+def open_file(file):
     
     """
-    Determine the number of header rows to skip when reading 
-    a VCF `file`
+    Opens `file` in text mode. Gzip files are decompressed in a separate process by `pigz` or 
+    `gzip -dc` when either is found in the PATH and with the gzip module otherwise. Raises OSError
+    when the decompressor fails on a file that was read to the end
+    
+    Parameters:
+        
+        file (string): path to the file
+        
+    Yields:
+    
+        file object: Text stream with the contents of the file
+    """
+    
+    command = next((cmd for cmd in DECOMPRESSORS if shutil.which(cmd[0])), None) if file.endswith('.gz') else None
+    
+    if command is None:
+        fn_open = gzip.open if file.endswith('.gz') else open
+        with fn_open(file, mode = 'rt') as fh:
+            yield fh
+        return
+    
+    if not os.path.exists(file):
+        raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), file)
+    
+    with subprocess.Popen(command + [file], stdout=subprocess.PIPE, stderr=subprocess.PIPE, bufsize=1<<20) as proc:
+        with io.TextIOWrapper(proc.stdout) as fh:
+            try:
+                yield fh
+            except BaseException:
+                proc.terminate()
+                raise
+            
+            if fh.read(1):
+                # the header functions stop reading early, so the decompressor may still be running
+                proc.terminate()
+            elif proc.wait() != 0:
+                # a corrupt or truncated file ends the stream early, report it as gzip.open() would
+                raise OSError('{} failed with exit status {} while decompressing {}: {}'.format(
+                    command[0], proc.returncode, file, proc.stderr.read().decode(errors='replace').strip()))
+
+def parse_header(file):
+    
+    """
+    Retrieve in a single pass over the header lines of a VCF `file` the number of rows to skip,
+    the keys for the INFO CSQ column, the identifier for the case and the sample ID of the tumor
     
     Parameters:
         
@@ -41,18 +135,44 @@ def rows2skip(file):
         
     Returns:
     
-        int: Number of header rows to skip
+        tuple: (skip_rows, csq_keys, identifier, sample_id)
     """
     
     skip_rows = 0
-    fn_open = gzip.open if file.endswith('.gz') else open
-    with fn_open(file, mode = 'rt') as fh:
+    csq_keys = ''
+    identifier = ''
+    sample_id = ''
+    with open_file(file) as fh:
         for line in fh:
             if line.startswith('##'):
                 skip_rows += 1
+                if line.startswith('##INFO=<ID=CSQ'):
+                    csq_keys = line.split('Format: ', 1)[1].replace('">\n', '').split('|')
+                elif line.startswith('##INDIVIDUAL'):
+                    identifier = line.split(',')[0].replace('##INDIVIDUAL=<NAME=', '')
+                elif line.startswith('##SAMPLE=<ID=TUMOR'):
+                    sample_id = line.split(',')[1].replace('NAME=', '')
             else:
-                break
-    return skip_rows
+                break # to prevent waisting time reading lines we dont use
+                
+    return (skip_rows, csq_keys, identifier, sample_id)
+
+def rows2skip(file):
+    
+    """
+    Determine the number of header rows to skip when reading 
+    a VCF `file`
+    
+    Parameters:
+        
+        file (string): path to the file
+        
+    Returns:
+    
+        int: Number of header rows to skip
+    """
+    
+    return parse_header(file)[0]
 
 def case_id(file):
     
@@ -68,26 +188,8 @@ def case_id(file):
         
         string: identifier for the case corresponding to the vcf file. 
     """
-    identifier = ''
-    sample_id = ''
-    fn_open = gzip.open if file.endswith('.gz') else open
-    with fn_open(file, mode = 'rt') as fh:
-        for line in fh:
-            if line.startswith('##'):
-                if line.startswith('##INDIVIDUAL'):
-                    identifier = line.split(',')[0].replace('##INDIVIDUAL=<NAME=', '')
-                    if len(identifier) > 0 and len(sample_id) > 0:
-                        break # if we have the info we need then break the loop 
-                elif line.startswith('##SAMPLE=<ID=TUMOR'):
-                    sample_id = line.split(',')[1].replace('NAME=', '')
-                    if len(identifier) > 0 and len(sample_id) > 0:
-                        break # if we have the info we need then break the loop 
-                else:
-                    continue
-            else:
-                break # to prevent waisting time reading lines we dont use
-                
-    return (identifier, sample_id)
+    
+    return parse_header(file)[2:]
 
 def csqkeys(file):
     
@@ -105,161 +207,315 @@ def csqkeys(file):
             column
     """
     
-    csq_keys = ''
-    fn_open = gzip.open if file.endswith('.gz') else open
-    with fn_open(file, mode = 'rt') as fh:
-        for line in fh:
-            if line.startswith('##INFO=<ID=CSQ'):
-                csq_keys = line.split('Format: ', 1)[1].replace('">\n', '').split('|')
-                break
-            else:
-                continue
-                
-    return csq_keys
+    return parse_header(file)[1]
 
-def update_value(dict_a, key, csq_keys):
+def to_categorical(df, columns):
     
     """
-    Updates the value of the 'CSQ' key in the INFO dictionary. Each variant and its corresponding information
-    are converted to a dictionary where the keys are `csq_keys` and the values are the orginal values present
-    for the 'CSQ' key. The value for the 'CSQ' key is updated to a list of dictionaries.
+    Converts the `columns` present in `df` to the categorical dtype. Used for columns 
+    with few distinct values to reduce memory and speed up filters and groupbys
     
     Parameters:
     
-        dict_a (dict): Dictionary made from the INFO column
+        df (pandas dataframe): Dataframe to convert
         
-        key (string): Name of the key to update
-        
-        csq_keys (list): Output of csqkeys()
+        columns (list): Names of the columns to convert
         
     Returns:
     
-        dict: Updated dict_a
+        pandas dataframe: `df` with the columns converted
     """
     
-    dict_a.update({key: [dict(zip(csq_keys, i.split('|'))) for i in dict_a[key].split(',')]})
-    
-    return dict_a
+    return df.astype({col: 'category' for col in columns if col in df.columns})
 
-def filter_variants(dict_a, variant, variant_class):
+def cached(process, cache_dir, file, *params):
     
     """
-    Keeps the specified type of `variant`
+    Returns the output of `process()`, a dataframe, caching it as a parquet file in `cache_dir`. 
+    The cache key is made from CACHE_VERSION, the path and modification time of `file` and `params`, 
+    so modifying the file or changing the filters processes the file again. Requires pyarrow.
     
     Parameters:
     
-        dict_a (dict): Dictionary made from the INFO column and updated using update_value()
+        process (callable): Function without arguments that processes `file`
         
-        variant (string): Name of the variant to subset
+        cache_dir (string): Directory of the cache. When None `process()` is always called
+        
+        file (string): path to the file
+        
+        params: Parameters used to process the file
         
     Returns:
     
-        dict: Subset of dict_a containing only the variants specified
+        pandas dataframe: Output of `process()`
     """
-    # Filter only the specified variants
-    dict_a.update({'CSQ': [i for i in dict_a['CSQ'] if variant in i['Consequence'] and variant_class in i['VARIANT_CLASS']]})
     
-    return dict_a
+    if cache_dir is None:
+        return process()
+    if pa is None:
+        raise ImportError('cache_dir requires pyarrow to write parquet files, install it or use cache_dir=None')
+    
+    key = '|'.join([str(CACHE_VERSION), os.path.abspath(file), str(os.path.getmtime(file))] + [str(param) for param in params])
+    path = os.path.join(cache_dir, hashlib.blake2b(key.encode(), digest_size=16).hexdigest() + '.parquet')
+    
+    if os.path.exists(path):
+        return pd.read_parquet(path)
+    
+    df = process()
+    
+    # write to a temporary file first so other processes never read a partial file
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    try:
+        df.to_parquet(tmp_path, compression='zstd')
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    
+    return df
 
-def filter_variants_maf(list_of_dicts, variant):
+def convert_output(df, output):
     
     """
-    Keeps the specified type of `variant`. For use with MAF files.
+    Converts a processed dataframe to the `output` format. See read_process_vcf()
     
     Parameters:
     
-        list_of_dicts (list of dictionaries): List of dictionaries made from the `all_effects` column in MAF files
+        df (pandas dataframe): Output of process_vcf() or process_maf()
         
-        variant (string): Name of the variant to subset
+        output (string): 'pandas', 'numpy' or 'arrow'
         
     Returns:
     
-        list: List of dictionaries containing only the type of variants specified in `variant`
+        pandas dataframe or pyarrow Table: `df` in the `output` format
     """
-    # Filter only the specified variants
-    updated_list_of_dicts = [dic for dic in list_of_dicts if variant in dic['Consequence_all_effects']]
     
-    if len(updated_list_of_dicts) > 0:
-        return updated_list_of_dicts
+    if output == 'numpy' or (output == 'pandas' and pa is None):
+        return df
+    elif output == 'pandas':
+        # the string methods of pyarrow-backed columns run on Arrow compute kernels
+        return df.convert_dtypes(dtype_backend='pyarrow')
+    elif output == 'arrow':
+        if pa is None:
+            raise ImportError("output='arrow' requires pyarrow, install it or use output='pandas' or 'numpy'")
+        return pa.Table.from_pandas(df)
     else:
-        return np.nan
+        raise ValueError("output must be 'pandas', 'numpy' or 'arrow', got {!r}".format(output))
 
-def find_variants(dict_a, id_list):
+def to_numeric(df, columns):
     
     """
-    Finds the transcript ID inside the INFO dictionary for a list of specified transcripts
-    and returns the CSQ dictionary corresponding to that variant
+    Converts the `columns` of `df`, read as strings, to numbers when all their values are numeric,
+    as pandas.read_csv() does when inferring the type of a column
     
     Parameters:
     
-        dict_a (dict): Dictionary made from the INFO column and processed with update_value()
-            and filter_variants()
-            
-        id_list: List of identifiers corresponding to the proteins/genes of interest
+        df (pandas dataframe): Dataframe to convert
+        
+        columns (list): Names of the columns to convert
         
     Returns:
+    
+        pandas dataframe: `df` with the numeric columns converted
+    """
+    
+    for col in columns:
+        try:
+            df[col] = pd.to_numeric(df[col])
+        except (ValueError, TypeError):
+            pass # the column has values that are not numbers
+    
+    return df
+
+def read_vcf_records(file, skip_rows, variant):
+    
+    """
+    Reads the records of a VCF `file` keeping only the variants that pass the filters and
+    mention `variant` in the INFO column. Uses the multithreaded pyarrow CSV reader when pyarrow 
+    is installed, otherwise the file is read in chunks with pandas. Supports gzip files.
+    
+    Parameters:
+    
+        file (string): path to the file
+        
+        skip_rows (int): Number of header rows to skip, output of parse_header()
         
-        dict: Dictionary inside CSQ that has a value for the 'Feature' key that
-            is contained in `id_list` 
+        variant (string): name of the variants to subset, the match is case sensitive
+        
+    Returns:
+    
+        pandas dataframe: Dataframe with the records of the VCF file
     """
     
-    variants = ''
-    for i in dict_a['CSQ']:
-        if i['Feature'] in id_list:
-            variants = i
+    if pa is not None:
+        
+        read_options = pacsv.ReadOptions(skip_rows=skip_rows, block_size=BLOCK_SIZE)
+        parse_options = pacsv.ParseOptions(delimiter='\t')
+        convert_options = pacsv.ConvertOptions(column_types={col: pa.int32() if dtype == 'int32' else pa.string() 
+                                                             for col, dtype in VCF_DTYPES.items()})
+        
+        # Filter each block of records before converting them to pandas, keeping the row number 
+        # of each record in the file as the index like the pandas reader does
+        batches = []
+        rows = [np.empty(0, dtype=np.int64)]
+        offset = 0
+        with pacsv.open_csv(file, read_options=read_options, parse_options=parse_options, convert_options=convert_options) as reader:
+            for batch in reader:
+                keep = pc.fill_null(pc.and_(pc.equal(batch['FILTER'], 'PASS'), pc.match_substring(batch['INFO'], variant)), False)
+                batches.append(batch.filter(keep))
+                rows.append(offset + np.flatnonzero(keep.to_numpy(zero_copy_only=False)))
+                offset += batch.num_rows
+            df = pa.Table.from_batches(batches, schema=reader.schema).to_pandas()
+        df.index = np.concatenate(rows)
     
-    if len(variants) > 0:
-        return variants
     else:
-        return np.nan
+        
+        with open_file(file) as fh, pd.read_csv(fh, sep = '\t', skiprows=skip_rows, dtype=VCF_DTYPES, 
+                                                     low_memory=False, chunksize=CHUNKSIZE) as reader:
+            df = pd.concat([chunk.loc[(chunk['FILTER'] == 'PASS') & (chunk['INFO'].str.contains(variant, regex=False))] 
+                            for chunk in reader])
     
+    return df.rename({'#CHROM': 'CHROM'}, axis = 1)
 
-def find_variants_maf(list_of_dicts, id_list):
+def split_csq(info, csq_keys, variant, variant_class, id_set):
     
     """
-    For use with MAF files
-    
-    Finds the transcript ID inside the `all_effects` dictionary for a list of specified transcripts
-    and returns the dictionary with information corresponding to that variant
+    Splits the VEP annotations in the 'CSQ' field of the INFO column into one row per annotation 
+    and one column per key, keeping only the annotations of the specified `variant` and `variant_class`
+    and, when `id_set` is not empty, for the ids in `id_set`. The fields are kept by position and the 
+    annotations are filtered before the rest of the fields are gathered and named with `csq_keys`.
+    The string scanning is done with pyarrow compute kernels when pyarrow is installed and with 
+    pandas string methods otherwise.
     
     Parameters:
     
-        dict_a (dict): Dictionary made from the INFO column and processed with update_value()
-            and filter_variants()
-            
-        id_list: List of identifiers corresponding to the proteins/genes of interest
+        info (pandas series): INFO column of a VCF file
+        
+        csq_keys (list): Keys for the values in the INFO CSQ column, output of parse_header()
+        
+        variant (string), variant_class (string): See read_process_vcf()
+        
+        id_set (frozenset): Set of Ensembl transcript identifiers to find in the annotations
         
     Returns:
+    
+        pandas dataframe: Dataframe with a column for each key in `csq_keys`. The index is 
+            repeated for each annotation of the same variant in `info`
+    """
+    
+    field_idx = {key: i for i, key in enumerate(csq_keys)}
+    
+    if pa is not None:
+        
+        # an empty or all-missing column would otherwise be converted to a null-typed array
+        info_array = pa.array(info.to_numpy(dtype=object), type=pa.string(), from_pandas=True)
+        
+        # Pull out the value of 'CSQ' and split it into annotations and each annotation into fields
+        csq = pc.struct_field(pc.extract_regex(info_array, CSQ_PATTERN.pattern), [0])
+        annotations = pc.split_pattern(csq, ',')
+        fields = pc.split_pattern(pc.list_flatten(annotations), '|', max_splits=len(csq_keys) - 1)
+        
+        starts = fields.offsets.to_numpy()[:-1]
+        lengths = pc.list_value_length(fields).to_numpy(zero_copy_only=False)
         
-        dict: Dictionary with the information corresponding to the trascript ids provided in `id_list` 
+        # Gather the i-th field of the annotations in `rows`, annotations with fewer fields are filled with nulls
+        def field(i, rows=slice(None)):
+            return pc.take(fields.values, pa.array(starts[rows] + i, mask=lengths[rows] <= i))
+        
+        # Filter the specified variants
+        keep = pc.and_(pc.match_substring(field(field_idx['Consequence']), variant), 
+                       pc.equal(field(field_idx['VARIANT_CLASS']), variant_class))
+        if len(id_set) > 0:
+            keep = pc.and_(keep, pc.is_in(field(field_idx['Feature']), value_set=pa.array(list(id_set), type=pa.string())))
+        rows = np.flatnonzero(pc.fill_null(keep, False).to_numpy(zero_copy_only=False))
+        
+        csq_df = pa.table([field(i, rows) for i in range(len(csq_keys))], names=csq_keys).to_pandas()
+        csq_df.index = info.index[pc.list_parent_indices(annotations).to_numpy()[rows]]
+        
+        return csq_df
+    
+    # Pull out the value of 'CSQ', records without annotations are dropped
+    csq = info.dropna().astype(str).str.extract(CSQ_PATTERN, expand=False).dropna()
+    
+    if csq.empty:
+        return pd.DataFrame(columns = csq_keys)
+    
+    # Place each of the comma separated annotations in its own row
+    csq = csq.str.split(',').explode()
+    
+    # Split the annotations on '|' into columns labelled by position
+    fields = csq.str.split('|', n = len(csq_keys) - 1, expand=True).reindex(columns = range(len(csq_keys)))
+    
+    # Filter the specified variants
+    keep = fields[field_idx['Consequence']].str.contains(variant, regex=False, na=False) & fields[field_idx['VARIANT_CLASS']].eq(variant_class)
+    if len(id_set) > 0:
+        keep &= fields[field_idx['Feature']].isin(id_set)
+    
+    csq_df = fields.loc[keep]
+    csq_df.columns = csq_keys
+    
+    return csq_df
+
+def process_vcf(file, skip_rows, csq_keys, variant, variant_class, id_set):
+    
+    """
+    Reads a VCF `file`, keeps the specified `variant` of `variant_class` and extends the 
+    dataframe with the annotation for the ids in `id_set`. See read_process_vcf()
+    
+    Parameters:
+    
+        file (string): path to the file
+        
+        skip_rows (int), csq_keys (list): Output of parse_header()
+        
+        variant (string), variant_class (string): See read_process_vcf()
+        
+        id_set (frozenset): Set of Ensembl transcript identifiers to find in the file
+        
+    Returns:
+    
+        pandas dataframe: Dataframe with the information from a VEP VCF file from NCI GDC
     """
     
-    variants = ''
-    for dic in list_of_dicts:
-        if dic['Transcript_ID_all_effects'] in id_list:
-            variants = dic
+    df = read_vcf_records(file, skip_rows, variant)
+    
+    # Split the annotations of the specified variants in 'CSQ' into columns named with the keys extracted from the header of the file using the function parse_header()
+    # Given a specified set of identifiers in `id_set` only the annotations corresponding to those proteins are kept
+    csq_df = split_csq(df['INFO'], csq_keys, variant, variant_class, id_set)
+    
+    if len(id_set) > 0:
+
+        csq_df = csq_df.loc[~csq_df.index.duplicated()] # keep the first annotation found for each variant
+        
+        # both frames share the index of the records, so they are aligned without resetting it first
+        df = pd.concat([df.loc[csq_df.index], csq_df], axis = 1).reset_index(drop = True)
     
-    if len(variants) > 0:
-        return variants
     else:
-        return np.nan
+        
+        # Keep the variants with at least one annotation of the specified variant
+        df = df.loc[df.index.isin(csq_df.index)]
     
+    return to_categorical(df, VCF_CATEGORY_COLUMNS)
 
-def read_process_vcf(file, variant, variant_class, id_list = [], return_case_id=False):
+def read_process_vcf(file, variant, variant_class, id_list = [], return_case_id=False, cache_dir=None, output='pandas'):
     
     """
     Reads and processes vcf files from NCI GDC. Supports .gzip files. 
     The comment lines are skipped, the keys for the INFO column
-    are retrieved and the INFO column is converted into a dictionary with the retrieved keys.
+    are retrieved and the 'CSQ' annotations in the INFO column are split into columns named with the retrieved keys.
     Variants that are not the specified `variant` are removed and the 
     dataframe is extended to include the information for the specified 
-    list of ids in `id_list`
+    list of ids in `id_list`. Only records with at least one 'CSQ' annotation whose 'Consequence' contains 
+    `variant` and whose 'VARIANT_CLASS' is `variant_class` are returned, also when `id_list` is empty; 
+    records that only mention `variant` elsewhere in the INFO column are dropped
     
     Parameters:
     
         file (string): path to the file
         
-        variant (string): name of the variants to subset
+        variant (string): name of the variants to subset, the match is case sensitive
             Examples of `variant`: 'missense_variant','downstream_gene_variant', 'upstream_gene_variant'
             
         variant_class (string): name of the variant class to subset
@@ -270,61 +526,120 @@ def read_process_vcf(file, variant, variant_class, id_list = [], return_case_id=
         return_case_id (bool): Whether the case id is to be returned. This id helps later when finding the 
             biospecimen and clinial metadata associated with the given vcf file
         
+        cache_dir (string): Directory where the processed dataframe is cached as a parquet file. Later calls
+            with the same file and filters read the cached dataframe. Requires pyarrow. No caching by default
+        
+        output (string): Format of the returned data. 'pandas' returns a dataframe with pyarrow-backed 
+            columns when pyarrow is installed, 'numpy' returns a dataframe with numpy-backed columns 
+            and 'arrow' returns a pyarrow Table
+        
     Returns:
     
         pandas dataframe: Dataframe with the information from a VEP VCF file from NCI GDC
     """
     
-    skip_rows = rows2skip(file)
-    csq_keys = csqkeys(file)
+    id_set = frozenset(id_list)
+    skip_rows, csq_keys, identifier, sample_id = parse_header(file)
     
-    df = pd.read_csv(file, sep = '\t', skiprows=skip_rows).rename({'#CHROM': 'CHROM'}, axis = 1)
+    process = functools.partial(process_vcf, file, skip_rows, csq_keys, variant, variant_class, id_set)
+    df = convert_output(cached(process, cache_dir, file, 'vcf', variant, variant_class, sorted(id_set)), output)
     
-    df = df.loc[(df['FILTER'] == 'PASS') & (df.INFO.str.contains(variant,case=False))]
+    if return_case_id == True:
+        
+        return (df, identifier, sample_id)
     
-    # Include '=nan' in cases where the field is empty. Example change 'IN_PON' to 'IN_PON=nan'
-    df['INFO'] = df['INFO'].apply(lambda x: [i + '=nan' if '=' not in i else i for i in x.split(';')])
+    else:
+        
+        return df
+        
+def process_maf_chunk(df, consequence, id_set, classification=None):
     
-    # Create a dictionary splitting on '='
-    df['INFO'] = df['INFO'].apply(lambda x: dict(item.split("=") for item in x))
+    """
+    Processes a chunk of rows from a MAF file. Uses the information in the 'all_effects' column
+    to keep the variants with the specified `consequence` and extends the chunk with the information
+    for the ids in `id_set`
     
-    # Convert the value of 'CSQ' to a dictionary where the keys are extracted from the header of the file using the function csqkeys()
-    df['INFO'] = df['INFO'].apply(lambda x: update_value(x, 'CSQ', csq_keys))
+    Parameters:
+    
+        df (pandas dataframe): Chunk of rows from a MAF file
+        
+        consequence (string): name of the consequence of the mutation
+        
+        id_set (frozenset): Set of identifiers to find in the chunk
+        
+        classification (string): When given only the variants with this 'Variant_Classification' are kept
+        
+    Returns:
+    
+        pandas dataframe: Subset of `df`, extended with the columns in MAF_KEYS when `id_set` is not empty
+    """
+    
+    # Discard the rows that cannot contain the specified variants before splitting 'all_effects'
+    keep = df['all_effects'].str.contains(consequence, regex=False, na=False)
+    if classification is not None:
+        keep &= df['Variant_Classification'] == classification
+    df = df.loc[keep]
+    
+    if df.empty:
+        return df.reindex(columns = list(df.columns) + MAF_KEYS) if len(id_set) > 0 else df
+    
+    # Place each effect in its own row and split it on ',' into columns named with MAF_KEYS
+    effects = df['all_effects'].str.split(';').explode()
+    effects_df = effects.str.split(',', n = len(MAF_KEYS) - 1, expand=True).reindex(columns = range(len(MAF_KEYS)))
+    effects_df.columns = MAF_KEYS
     
     # Filter the specified variants
-    df['INFO'] = df['INFO'].apply(lambda x: filter_variants(x, variant, variant_class))
+    effects_df = effects_df.loc[effects_df['Consequence_all_effects'].str.contains(consequence, regex=False, na=False)]
     
-    # Given a specified list of identifiers in `id_list` find the mutations corresponding to those proteins
-    if len(id_list) > 0:
+    # Given a specified set of identifiers in `id_set` find the mutations corresponding to those proteins
+    if len(id_set) > 0:
 
-        df['Variant_INFO'] = df['INFO'].apply(lambda x: find_variants(x, id_list))
-        df = df.dropna(subset = ['Variant_INFO'])
+        effects_df = effects_df.loc[effects_df['Transcript_ID_all_effects'].isin(id_set)]
+        effects_df = effects_df.loc[~effects_df.index.duplicated()] # keep the first effect found for each variant
         
-        df_variant = pd.json_normalize(df['Variant_INFO'])
-        df_extended = pd.concat([df.drop(['Variant_INFO'], axis = 1).reset_index(drop = True), df_variant], axis = 1)
-        
-        if return_case_id == True:
-            
-            identifier, sample_id = case_id(file)
-            return (df_extended, identifier, sample_id)
+        return pd.concat([df.loc[effects_df.index], effects_df], axis = 1)
+    
+    else:        
         
-        else:
-            
-            return df_extended
+        # Drop rows without the specified variants
+        return df.loc[df.index.isin(effects_df.index)]
+
+def process_maf(file, consequence, id_set, classification=None):
     
-    else:
+    """
+    Reads a MAF `file` in chunks processed with process_maf_chunk(). See read_process_maf()
+    
+    Parameters:
+    
+        file (string): path to the file
         
-        if return_case_id == True:
-            
-            identifier, sample_id = case_id(file)        
-            return (df, identifier, sample_id)
+        consequence (string): name of the consequence of the mutation
         
-        else:
-            
-            return df
+        id_set (frozenset): Set of identifiers to find in the file
         
+        classification (string): See process_maf_chunk()
         
-def read_process_maf(file, variant='Missense_Mutation', consequence='missense_variant', variant_class='SNP', id_list = []):
+    Returns:
+    
+        pandas dataframe: Dataframe with the information from a MAF file from NCI GDC
+    """
+    
+    # Read the MAF file in chunks keeping only the variants of interest from each chunk. The chunks are read
+    # as strings and the types are inferred once on the rows kept, so a column is never numeric in one chunk
+    # and text in another
+    with pd.read_csv(file, sep = '\t', comment='#', dtype=str, chunksize=CHUNKSIZE) as reader:
+        df = pd.concat([process_maf_chunk(chunk, consequence, id_set, classification) for chunk in reader])
+    
+    df = to_numeric(df, [col for col in df.columns if col not in MAF_KEYS])
+    
+    if len(id_set) > 0:
+        
+        df = df.reset_index(drop = True)
+    
+    return to_categorical(df, MAF_CATEGORY_COLUMNS)
+
+def read_process_maf(file, variant='Missense_Mutation', consequence='missense_variant', variant_class='SNP', id_list = [], cache_dir=None, 
+                     filter_classification=False, output='pandas'):
     
     """
     Reads and processes MAF files from NCI GDC. Uses the information in 
@@ -348,40 +663,85 @@ def read_process_maf(file, variant='Missense_Mutation', consequence='missense_va
             
         id_list (list): List of identifiers to find in the file
         
+        cache_dir (string): Directory where the processed dataframe is cached as a parquet file. Later calls
+            with the same file and filters read the cached dataframe. Requires pyarrow. No caching by default
+        
+        filter_classification (bool): Whether to keep only the variants with 'Variant_Classification' equal
+            to `variant`. By default variants reported with another classification for the canonical 
+            transcript, for example 'Silent', are kept when `consequence` is found for another transcript
+        
+        output (string): Format of the returned data. 'pandas' returns a dataframe with pyarrow-backed 
+            columns when pyarrow is installed, 'numpy' returns a dataframe with numpy-backed columns 
+            and 'arrow' returns a pyarrow Table
+        
     Returns:
     
         pandas dataframe: Dataframe with the information from a MAF file from NCI GDC
     """
     
-    # Open the MAF file
-    df = pd.read_csv(file, sep = '\t', comment='#', low_memory=False)
+    id_set = frozenset(id_list)
     
-    # from https://docs.gdc.cancer.gov/Data/File_Formats/MAF_Format/#:~:text=46%20%2D%20all_effects,Sift%2CPolyPhen%2CStrand%5D)
-    # added 'all_effects' to the end of each key to avoid column names already present in the MAF files
-    keys = ['Symbol_all_effects','Consequence_all_effects','HGVSp_Short_all_effects','Transcript_ID_all_effects',\
-            'RefSeq_all_effects','HGVSc_all_effects','Impact_all_effects','Canonical_all_effects',\
-            'Sift_all_effects','PolyPhen_all_effects','Strand_all_effects'] 
+    classification = variant if filter_classification == True else None
     
-    # Create a list of dictionaries splitting on first on ';', then on ',' and using the keys above
-    df['all_effects'] = df['all_effects'].apply(lambda x: [dict(zip(keys, i.split(','))) for i in x.split(';')])
+    process = functools.partial(process_maf, file, consequence, id_set, classification)
     
-    # Filter the specified variants
-    df['all_effects'] = df['all_effects'].apply(lambda x: filter_variants_maf(x, consequence))
+    return convert_output(cached(process, cache_dir, file, 'maf', consequence, sorted(id_set), classification), output)
+
+def read_process_vcf_many(files, variant, variant_class, id_list = [], return_case_id=False, cache_dir=None, output='pandas', 
+                          max_workers=None):
     
-    # Drop rows without the specified variants
-    df.dropna(axis=0, subset=['all_effects'], inplace=True)
+    """
+    Reads and processes several vcf files from NCI GDC in parallel, one process per file,
+    using read_process_vcf()
     
-    # Given a specified list of identifiers in `id_list` find the mutations corresponding to those proteins
-    if len(id_list) > 0:
-
-        df['Variant_INFO'] = df['all_effects'].apply(lambda x: find_variants_maf(x, id_list))
-        df = df.dropna(subset = ['Variant_INFO'])
+    Parameters:
+    
+        files (list): List of paths to the files. Each path can only appear once
+        
+        variant, variant_class, id_list, return_case_id, cache_dir, output: See read_process_vcf()
         
-        df_variant = pd.json_normalize(df['Variant_INFO'])
-        df_extended = pd.concat([df.drop(['Variant_INFO'], axis = 1).reset_index(drop = True), df_variant], axis = 1)
+        max_workers (int): Maximum number of processes. Defaults to the number of CPUs
         
-        return df_extended
+    Returns:
     
-    else:        
+        dict: Dictionary where the keys are `files` and the values are the output of read_process_vcf()
+    """
+    
+    process = functools.partial(read_process_vcf, variant=variant, variant_class=variant_class, 
+                                id_list=id_list, return_case_id=return_case_id, cache_dir=cache_dir, output=output)
+    
+    if len(set(files)) != len(files):
+        raise ValueError('files contains duplicate paths')
+    
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        return dict(zip(files, executor.map(process, files)))
+
+def read_process_maf_many(files, variant='Missense_Mutation', consequence='missense_variant', variant_class='SNP', id_list = [], cache_dir=None, 
+                          filter_classification=False, output='pandas', max_workers=None):
+    
+    """
+    Reads and processes several MAF files from NCI GDC in parallel, one process per file,
+    using read_process_maf()
+    
+    Parameters:
+    
+        files (list): List of paths to the files. Each path can only appear once
+        
+        variant, consequence, variant_class, id_list, cache_dir, filter_classification, output: See read_process_maf()
+        
+        max_workers (int): Maximum number of processes. Defaults to the number of CPUs
         
-        return df
\ No newline at end of file
+    Returns:
+    
+        dict: Dictionary where the keys are `files` and the values are the output of read_process_maf()
+    """
+    
+    process = functools.partial(read_process_maf, variant=variant, consequence=consequence, 
+                                variant_class=variant_class, id_list=id_list, cache_dir=cache_dir, 
+                                filter_classification=filter_classification, output=output)
+    
+    if len(set(files)) != len(files):
+        raise ValueError('files contains duplicate paths')
+    
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        return dict(zip(files, executor.map(process, files)))
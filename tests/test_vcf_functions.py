@@ -0,0 +1,276 @@
+"""
+Regression tests for VCF_functions.py using the sample files in data/
+
+Each test runs once with the pandas code paths (pyarrow hidden from the module)
+and once with the pyarrow code paths when pyarrow is installed.
+"""
+
+import gzip
+import os
+import sys
+
+import pytest
+
+pd = pytest.importorskip('pandas')
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import VCF_functions as vcf
+
+VCF_FILE = os.path.join(ROOT, 'data', 'vcf_data', 'a', 'a.vcf')
+MAF_FILE = os.path.join(ROOT, 'data', 'maf_data', 'a.maf')
+
+BACKENDS = ['pandas', 'pyarrow']
+
+@pytest.fixture(params=BACKENDS)
+def backend(request, monkeypatch):
+    if request.param == 'pandas':
+        monkeypatch.setattr(vcf, 'pa', None)
+    else:
+        pytest.importorskip('pyarrow')
+    return request.param
+
+def write_vcf(path, records):
+
+    """Write a VCF with the header of VCF_FILE and the given record lines"""
+
+    with open(VCF_FILE) as fh:
+        header = [line for line in fh if line.startswith('#')]
+    with open(path, 'w') as fh:
+        fh.writelines(header + [record + '\n' for record in records])
+    return str(path)
+
+def test_vcf_missense_with_ids(backend):
+    df = vcf.read_process_vcf(VCF_FILE, 'missense_variant', 'SNV', id_list=['ENST00000318560'], output='numpy')
+    assert df.shape == (1, 77)
+    assert df.loc[0, 'Feature'] == 'ENST00000318560'
+    assert df.loc[0, 'HGVSp'] == 'ENSP00000478255.1:p.Thr810Ala'
+
+def test_vcf_no_matching_variant(backend):
+    df = vcf.read_process_vcf(VCF_FILE, 'frameshift_variant', 'SNV', output='numpy')
+    assert df.shape == (0, 11)
+
+def test_vcf_no_matching_variant_with_ids(backend):
+    df = vcf.read_process_vcf(VCF_FILE, 'frameshift_variant', 'SNV', id_list=['ENST00000318560'], output='numpy')
+    assert len(df) == 0
+
+def test_vcf_header_only(backend, tmp_path):
+    file = write_vcf(tmp_path / 'header.vcf', [])
+    df = vcf.read_process_vcf(file, 'missense_variant', 'SNV', output='numpy')
+    assert df.shape == (0, 11)
+
+def test_vcf_records_without_csq(backend, tmp_path):
+    file = write_vcf(tmp_path / 'no_csq.vcf', ['chr1\t5\t.\tA\tG\t.\tPASS\tDP=3;missense_variant_flag\t.\t.\t.'])
+    df = vcf.read_process_vcf(file, 'missense_variant', 'SNV', output='numpy')
+    assert df.shape == (0, 11)
+
+def test_vcf_without_ids_keeps_only_records_with_matching_annotation(backend, tmp_path):
+    with open(VCF_FILE) as fh:
+        record = [line for line in fh if line.startswith('chr7\t1111')][0].rstrip('\n')
+    # same record with a VARIANT_CLASS other than 'SNV' in every annotation
+    other_class = record.replace('chr7\t1111', 'chr7\t2222').replace('|SNV|', '|insertion|')
+    file = write_vcf(tmp_path / 'classes.vcf', [record, other_class])
+    df = vcf.read_process_vcf(file, 'missense_variant', 'SNV', output='numpy')
+    assert df['POS'].tolist() == [1111]
+    assert df.index.tolist() == [0]
+
+def test_vcf_index_matches_file_rows(backend, tmp_path, monkeypatch):
+    with open(VCF_FILE) as fh:
+        record = [line for line in fh if line.startswith('chr7\t1111')][0].rstrip('\n')
+    not_pass = record.replace('\tPASS\t', '\tgermline_risk\t')
+    file = write_vcf(tmp_path / 'index.vcf', [not_pass, record, record.replace('chr7\t1111', 'chr7\t3333')])
+    df = vcf.read_process_vcf(file, 'missense_variant', 'SNV', output='numpy')
+    assert df.index.tolist() == [1, 2]
+    assert df['POS'].tolist() == [1111, 3333]
+    # a small block size splits the records over several Arrow batches
+    monkeypatch.setattr(vcf, 'BLOCK_SIZE', 4096)
+    monkeypatch.setattr(vcf, 'CHUNKSIZE', 1)
+    assert vcf.read_process_vcf(file, 'missense_variant', 'SNV', output='numpy').index.tolist() == [1, 2]
+
+def write_vcf_gz(path, n_records):
+
+    """Write a gzip VCF with the header of VCF_FILE and `n_records` copies of its first record"""
+
+    with open(VCF_FILE) as fh:
+        lines = fh.readlines()
+    record = [line for line in lines if not line.startswith('#')][0]
+    with gzip.open(path, 'wt') as fh:
+        fh.writelines([line for line in lines if line.startswith('#')] + [record] * n_records)
+    return str(path)
+
+def test_parse_header_missing_gz():
+    with pytest.raises(FileNotFoundError):
+        vcf.parse_header(os.path.join(ROOT, 'missing.vcf.gz'))
+
+@pytest.fixture(params=['pigz', 'gzip', 'module'])
+def decompressor(request, monkeypatch):
+    if request.param == 'module':
+        monkeypatch.setattr(vcf, 'DECOMPRESSORS', [])
+    elif vcf.shutil.which(request.param) is None:
+        pytest.skip('{} is not installed'.format(request.param))
+    else:
+        monkeypatch.setattr(vcf, 'DECOMPRESSORS', [cmd for cmd in vcf.DECOMPRESSORS if cmd[0] == request.param])
+    return request.param
+
+def test_parse_header_not_gzip(tmp_path, decompressor):
+    file = tmp_path / 'plain.vcf.gz'
+    with open(VCF_FILE) as fh:
+        file.write_text(fh.read())
+    with pytest.raises(OSError):
+        vcf.parse_header(str(file))
+
+def test_vcf_gz(backend, tmp_path, decompressor):
+    file = write_vcf_gz(tmp_path / 'a.vcf.gz', 1000)
+    assert vcf.rows2skip(file) == 13
+    assert vcf.read_process_vcf(file, 'missense_variant', 'SNV', output='numpy').shape == (1000, 11)
+
+def test_vcf_truncated_gz(backend, tmp_path, decompressor):
+    file = write_vcf_gz(tmp_path / 'a.vcf.gz', 20000)
+    with open(file, 'rb') as fh:
+        data = fh.read()
+    with open(file, 'wb') as fh:
+        fh.write(data[:len(data) // 2])
+    with pytest.raises((OSError, EOFError)):
+        vcf.read_process_vcf(file, 'missense_variant', 'SNV', output='numpy')
+
+def write_maf(path, pubmed):
+
+    """Write MAF_FILE with the PUBMED column replaced by the values in `pubmed`"""
+
+    df = pd.read_csv(MAF_FILE, sep='\t', comment='#', low_memory=False)
+    df['PUBMED'] = pubmed[:len(df)]
+    df.to_csv(path, sep='\t', index=False)
+    return str(path)
+
+def test_maf(backend):
+    df = vcf.read_process_maf(MAF_FILE, output='numpy')
+    assert df.shape == (33, 140)
+    df = vcf.read_process_maf(MAF_FILE, id_list=['ENST00000574428', 'ENST00000318247'], output='numpy')
+    assert df['Symbol_all_effects'].tolist() == ['ATPAF1', 'RORC']
+    df = vcf.read_process_maf(MAF_FILE, filter_classification=True, output='numpy')
+    assert len(df) == 31
+    assert set(df['Variant_Classification']) == {'Missense_Mutation'}
+
+def test_maf_types_consistent_across_chunks(backend, tmp_path, monkeypatch):
+    monkeypatch.setattr(vcf, 'CHUNKSIZE', 10)
+    file = write_maf(tmp_path / 'a.maf', ['789'] * 10 + ['123;456'] * 50)
+    df = vcf.read_process_maf(file, output='numpy')
+    assert set(map(type, df['PUBMED'].dropna())) == {str}
+
+def test_maf_column_not_numeric_in_every_chunk(backend, tmp_path, monkeypatch):
+    monkeypatch.setattr(vcf, 'CHUNKSIZE', 10)
+    df = pd.read_csv(MAF_FILE, sep='\t', comment='#', low_memory=False)
+    df['Chromosome'] = ['17'] * 30 + ['X'] * (len(df) - 30)
+    file = tmp_path / 'a.maf'
+    df.to_csv(file, sep='\t', index=False)
+    df = vcf.read_process_maf(str(file), output='numpy')
+    assert set(map(type, df['Chromosome'])) == {str}
+    assert df['Start_Position'].dtype == 'int64'
+    assert df['1000G_AF'].dtype == 'float64'
+    if backend == 'pyarrow':
+        assert vcf.read_process_maf(str(file), output='arrow').num_rows == len(df)
+        assert len(vcf.read_process_maf(str(file), cache_dir=str(tmp_path / 'cache'))) == len(df)
+
+def test_maf_cache(tmp_path, monkeypatch):
+    pytest.importorskip('pyarrow')
+    monkeypatch.setattr(vcf, 'CHUNKSIZE', 10)
+    file = write_maf(tmp_path / 'a.maf', ['789'] * 10 + ['123;456'] * 50)
+    cache_dir = tmp_path / 'cache'
+    first = vcf.read_process_maf(file, cache_dir=str(cache_dir), output='numpy')
+    second = vcf.read_process_maf(file, cache_dir=str(cache_dir), output='numpy')
+    assert first.shape == second.shape == (33, 140)
+    assert first['PUBMED'].tolist() == second['PUBMED'].tolist()
+    assert [path.suffix for path in cache_dir.iterdir()] == ['.parquet']
+
+def test_cache_misses(tmp_path, monkeypatch):
+    pytest.importorskip('pyarrow')
+    file = tmp_path / 'a.maf'
+    with open(MAF_FILE) as fh:
+        file.write_text(fh.read())
+    file, cache_dir = str(file), str(tmp_path / 'cache')
+    calls = []
+    process_maf = vcf.process_maf
+    monkeypatch.setattr(vcf, 'process_maf', lambda *args: calls.append(args) or process_maf(*args))
+    vcf.read_process_maf(file, cache_dir=cache_dir)
+    vcf.read_process_maf(file, cache_dir=cache_dir)
+    assert len(calls) == 1
+    vcf.read_process_maf(file, cache_dir=cache_dir, filter_classification=True)
+    vcf.read_process_maf(file, cache_dir=cache_dir, id_list=['ENST00000574428'])
+    assert len(calls) == 3
+    os.utime(file, (0, 0))
+    vcf.read_process_maf(file, cache_dir=cache_dir)
+    assert len(calls) == 4
+    monkeypatch.setattr(vcf, 'CACHE_VERSION', vcf.CACHE_VERSION + 1)
+    vcf.read_process_maf(file, cache_dir=cache_dir)
+    assert len(calls) == 5
+
+def test_cache_without_pyarrow(tmp_path, monkeypatch):
+    monkeypatch.setattr(vcf, 'pa', None)
+    monkeypatch.setattr(vcf, 'process_vcf', lambda *args: pytest.fail('file processed before the pyarrow check'))
+    with pytest.raises(ImportError, match='pyarrow'):
+        vcf.read_process_vcf(VCF_FILE, 'missense_variant', 'SNV', cache_dir=str(tmp_path / 'cache'))
+
+def test_cache_removes_partial_file(tmp_path, monkeypatch):
+    pytest.importorskip('pyarrow')
+    def fail(self, path, **kwargs):
+        open(path, 'w').close()
+        raise ValueError('write failed')
+    monkeypatch.setattr(pd.DataFrame, 'to_parquet', fail)
+    cache_dir = tmp_path / 'cache'
+    with pytest.raises(ValueError):
+        vcf.read_process_vcf(VCF_FILE, 'missense_variant', 'SNV', cache_dir=str(cache_dir))
+    assert list(cache_dir.iterdir()) == []
+
+def test_maf_no_matching_consequence(backend):
+    assert vcf.read_process_maf(MAF_FILE, consequence='start_lost_xyz', output='numpy').shape == (0, 140)
+    assert vcf.read_process_maf(MAF_FILE, consequence='start_lost_xyz', id_list=['ENST00000574428'], output='numpy').shape == (0, 151)
+
+def test_maf_chunk_without_match(backend, monkeypatch):
+    expected = vcf.read_process_maf(MAF_FILE, consequence='frameshift_variant', output='numpy')
+    monkeypatch.setattr(vcf, 'CHUNKSIZE', 10)
+    df = vcf.read_process_maf(MAF_FILE, consequence='frameshift_variant', output='numpy')
+    assert df.index.tolist() == expected.index.tolist() != []
+    df = vcf.read_process_maf(MAF_FILE, consequence='frameshift_variant', id_list=['ENST00000574428'], output='numpy')
+    assert df.shape[1] == 151
+
+def test_arrow_output(backend):
+    if backend == 'pandas':
+        with pytest.raises(ImportError, match='pyarrow'):
+            vcf.read_process_vcf(VCF_FILE, 'missense_variant', 'SNV', output='arrow')
+    else:
+        table = vcf.read_process_vcf(VCF_FILE, 'missense_variant', 'SNV', output='arrow')
+        assert table.num_rows == 1
+
+def test_invalid_output():
+    with pytest.raises(ValueError):
+        vcf.read_process_maf(MAF_FILE, output='x')
+
+def test_vcf_many(tmp_path):
+    other = write_vcf(tmp_path / 'b.vcf', [])
+    dfs = vcf.read_process_vcf_many([VCF_FILE, other], 'missense_variant', 'SNV', return_case_id=True, output='numpy', max_workers=2)
+    assert list(dfs) == [VCF_FILE, other]
+    df, identifier, sample_id = dfs[VCF_FILE]
+    assert df.shape == (1, 11)
+    assert (identifier, sample_id) == vcf.case_id(VCF_FILE)
+    assert dfs[other][0].shape == (0, 11)
+
+def test_maf_many():
+    dfs = vcf.read_process_maf_many([MAF_FILE], output='numpy', max_workers=2)
+    assert dfs[MAF_FILE].shape == (33, 140)
+
+def test_many_duplicate_paths():
+    with pytest.raises(ValueError):
+        vcf.read_process_vcf_many([VCF_FILE, VCF_FILE], 'missense_variant', 'SNV')
+    with pytest.raises(ValueError):
+        vcf.read_process_maf_many([MAF_FILE, MAF_FILE])
+
+def test_categorical_columns(backend):
+    df = vcf.read_process_vcf(VCF_FILE, 'missense_variant', 'SNV', id_list=['ENST00000318560'], output='numpy')
+    assert all(df[col].dtype == 'category' for col in vcf.VCF_CATEGORY_COLUMNS)
+    df = vcf.read_process_maf(MAF_FILE, id_list=['ENST00000574428'], output='numpy')
+    assert all(df[col].dtype == 'category' for col in vcf.MAF_CATEGORY_COLUMNS)
+    if backend == 'pyarrow':
+        df = vcf.read_process_vcf(VCF_FILE, 'missense_variant', 'SNV', id_list=['ENST00000318560'])
+        assert df['IMPACT'].dtype == 'category'
+        assert isinstance(df['Feature'].dtype, pd.ArrowDtype)